@@ -16,17 +16,31 @@
 """NitroML benchmark pipeline result overview."""
 
 import ast
+import collections
+import copy
 import datetime
+import functools
 import json
 import os
 import re
-from typing import Dict, Any, List, NamedTuple, Optional, Text
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Text, Tuple
 
 import pandas as pd
 import tensorflow.compat.v2 as tf
 
 from ml_metadata import metadata_store
 from ml_metadata.proto import metadata_store_pb2
+# pylint: disable=g-import-not-at-top
+try:
+  import orjson  # type: ignore
+  _json_loads = orjson.loads
+except ModuleNotFoundError:
+  _json_loads = json.loads
+try:
+  import pyarrow as pa  # type: ignore
+except ModuleNotFoundError:
+  pa = None
+# pylint: enable=g-import-not-at-top
 
 # Column name constants
 RUN_ID_KEY = 'run_id'
@@ -65,12 +79,31 @@ _DATAFRAME_CONTEXTUAL_COLUMNS = (STARTED_AT, RUN_ID_KEY, BENCHMARK_FULL_KEY,
 _DEFAULT_CUSTOM_PROPERTIES = {
     _NAME, _PRODUCER_COMPONENT, _STATE, _PIPELINE_NAME
 }
+_EXCLUDED_METRIC_COLUMNS = frozenset(
+    {_NAME, _PRODUCER_COMPONENT, _STATE, *_DEFAULT_COLUMNS})
+
+# pandas>=2 can back DataFrame columns with pyarrow arrays.
+_PANDAS_MAJOR_VERSION = int(pd.__version__.split('.')[0])
+
+# MLMD constants
+_PAGE_SIZE = 1000
+
+# Parsing constants
+_HPARAM_RE = re.compile(r"'([^']*)'")
+# The JSON number grammar, which is narrower than what int() and float() accept.
+_JSON_NUMBER_RE = re.compile(
+    r'[ \t\n\r]*-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?[ \t\n\r]*')
+_RUN_SUFFIX_PATTERN = r'\.run_\d+_of_\d+$'
+_SCALAR_CONSTANTS = {'true': True, 'false': False, 'null': None, 'none': None}
 
 
 class _Result(NamedTuple):
-  """Wrapper for properties and property names."""
-  properties: Dict[str, Dict[str, Any]]
-  property_names: List[str]
+  """Wrapper for properties and property names.
+
+  Properties are keyed by (run_id, benchmark) tuples.
+  """
+  properties: Dict[Tuple[Text, Text], Dict[str, Any]]
+  property_names: Set[str]
 
 
 class _RunInfo(NamedTuple):
@@ -79,36 +112,68 @@ class _RunInfo(NamedTuple):
   component_name: Text
 
 
-def _merge_results(results: List[_Result]) -> _Result:
-  """Merges _Result objects into one."""
-  properties = {}
-  property_names = []
+def _merge_results(results: List[_Result],
+                   keys: Iterable[Tuple[Text, Text]]) -> _Result:
+  """Merges the rows of _Result objects that have one of the given keys.
+
+  Rows are merged in order, so properties of later results overwrite the ones
+  of earlier results. Rows with other keys are dropped while merging, and so
+  are property names that only occur in dropped rows.
+
+  Args:
+    results: A list of _Result objects.
+    keys: The keys of the rows to keep.
+
+  Returns:
+    A _Result object with the merged properties and their property names.
+  """
+  properties = {key: {} for key in keys}
+  property_names = set()
   for result in results:
+    merged_names = set()
     for key, props in result.properties.items():
-      if key in properties:
-        properties[key].update(props)
-      else:
-        properties[key] = props
-    property_names += result.property_names
+      merged = properties.get(key)
+      if merged is not None:
+        merged.update(props)
+        merged_names.update(props)
+    property_names.update(result.property_names & merged_names)
   return _Result(properties=properties, property_names=property_names)
 
 
+@functools.lru_cache(maxsize=8192)
+def _parse_scalar(val: str) -> Any:
+  """Converts a scalar string to int, float, bool or None when possible."""
+  match = _JSON_NUMBER_RE.fullmatch(val)
+  if match is None:
+    return _SCALAR_CONSTANTS.get(val.lower(), val)
+  fraction, exponent = match.groups()
+  if fraction is None and exponent is None:
+    return int(val)
+  return float(val)
+
+
 def _to_pytype(val: str) -> Any:
-  """Coverts val to python type."""
-  try:
-    return json.loads(val.lower())
-  except ValueError:
-    return val
+  """Converts val to python type."""
+  # Only lists and dicts need the JSON parser (orjson if installed).
+  if val.startswith(('[', '{')):
+    try:
+      return _json_loads(val.lower())
+    except ValueError:
+      return val
+  return _parse_scalar(val)
 
 
 def _parse_value(value: metadata_store_pb2.Value) -> Any:
   """Parse value from `metadata_store_pb2.Value` proto."""
-  if value.HasField('int_value'):
+  field = value.WhichOneof('value')
+  if field == 'int_value':
     return value.int_value
-  elif value.HasField('double_value'):
+  elif field == 'double_value':
     return value.double_value
+  elif field == 'bool_value':
+    return value.bool_value
   else:
-    return _to_pytype(value.string_value)
+    return _parse_scalar(value.string_value)
 
 
 def _parse_hparams(hp_prop: str) -> Dict[str, Any]:
@@ -125,14 +190,99 @@ def _parse_hparams(hp_prop: str) -> Dict[str, Any]:
   # TFX using __str__. See for details:
   # http://google3/third_party/py/tfx/orchestration/metadata.py?q=function:_update_execution_proto
   # TODO(b/151084437): Move deserialization code to TFX.
-  hp_strings = ast.literal_eval(hp_prop)
+  hp_prop = hp_prop.strip()
+  if (hp_prop.startswith('[') and hp_prop.endswith(']') and
+      '"' not in hp_prop and '\\' not in hp_prop):
+    # Plain single-quoted items can be extracted without building an AST.
+    hp_strings = _HPARAM_RE.findall(hp_prop[1:-1])
+  else:
+    hp_strings = ast.literal_eval(hp_prop)
   hparams = {}
   for hp in hp_strings:
-    name, val = hp.split('=')
+    name, _, val = hp.partition('=')
     hparams[name] = _to_pytype(val)
   return hparams
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_started_at(run_id: str) -> Any:
+  """Returns the start time encoded in run_id, or run_id if it has none."""
+  # BeamDagRunner uses iso format timestamp. See for details:
+  # http://google3/third_party/py/tfx/orchestration/beam/beam_dag_runner.py
+  try:
+    return datetime.datetime.fromtimestamp(int(run_id))
+  except ValueError:
+    return run_id
+
+
+def _parse_hparams_strings(hp_props: List[str]) -> Dict[str, Dict[str, Any]]:
+  """Parses each distinct hparams properties string once.
+
+  Args:
+    hp_props: hparams properties strings, possibly with duplicates.
+
+  Returns:
+    A dictionary mapping each hparams properties string to its hparams.
+  """
+  return {
+      hp_prop: _parse_hparams(hp_prop) for hp_prop in dict.fromkeys(hp_props)
+  }
+
+
+def _supports_filter_query() -> bool:
+  """Returns whether the installed MLMD client can filter listed nodes."""
+  list_options = getattr(metadata_store, 'ListOptions', None)
+  return list_options is not None and hasattr(list_options(), 'filter_query')
+
+
+_SUPPORTS_FILTER_QUERY = _supports_filter_query()
+
+
+def _iter_by_type(list_fn: Callable[..., List[Any]],
+                  by_type_fn: Callable[[str], List[Any]],
+                  type_name: str,
+                  page_size: int = _PAGE_SIZE) -> Iterator[Any]:
+  """Yields the MLMD nodes of the given type, one page at a time.
+
+  The MetadataStore python client does not expose page tokens, so pages are
+  requested in id order and each page starts after the last id seen. MLMD
+  releases whose ListOptions lack `filter_query` fetch all nodes in one call.
+
+  Args:
+    list_fn: A MetadataStore method accepting `list_options`, e.g.
+      `store.get_executions` or `store.get_artifacts`.
+    by_type_fn: The matching unpaged MetadataStore method, e.g.
+      `store.get_executions_by_type` or `store.get_artifacts_by_type`.
+    type_name: The name of the execution or artifact type to list.
+    page_size: The maximum number of nodes requested per call.
+
+  Yields:
+    The nodes of type `type_name` in ascending id order.
+  """
+  if not _SUPPORTS_FILTER_QUERY:
+    yield from sorted(by_type_fn(type_name), key=lambda node: node.id)
+    return
+  last_id = 0
+  while True:
+    page = list_fn(
+        list_options=metadata_store.ListOptions(
+            limit=page_size,
+            order_by=metadata_store.OrderByField.ID,
+            is_asc=True,
+            filter_query=f"type = '{type_name}' AND id > {last_id}"))
+    yield from page
+    if len(page) < page_size:
+      return
+    last_id = page[-1].id
+
+
+def _iter_chunks(ids: Sequence[int],
+                 chunk_size: int = _PAGE_SIZE) -> Iterator[Sequence[int]]:
+  """Yields consecutive chunks of at most chunk_size ids."""
+  for start in range(0, len(ids), chunk_size):
+    yield ids[start:start + chunk_size]
+
+
 def _get_hparams(store: metadata_store.MetadataStore) -> _Result:
   """Returns the hparams of the EstimatorTrainer component.
 
@@ -145,24 +295,33 @@ def _get_hparams(store: metadata_store.MetadataStore) -> _Result:
   results = {}
   hparam_names = set()
 
-  trainer_execs = store.get_executions_by_type(_TRAINER)
-  for ex in trainer_execs:
-    run_id = ex.properties[RUN_ID_KEY].string_value
-    hparams = _parse_hparams(ex.properties[_HPARAMS].string_value)
+  # Trainer component ids are the trainer prefix, a '.' and the benchmark name.
+  prefix_len = len(_TRAINER_PREFIX) + 1
+  trainer_runs = []
+  for ex in _iter_by_type(store.get_executions,
+                          store.get_executions_by_type, _TRAINER):
+    props = ex.properties
+    trainer_runs.append((props[RUN_ID_KEY].string_value,
+                         props[_COMPONENT_ID].string_value[prefix_len:],
+                         props[_HPARAMS].string_value))
+
+  parsed_hparams = _parse_hparams_strings(
+      [hp_prop for _, _, hp_prop in trainer_runs])
+  for run_id, benchmark, hp_prop in trainer_runs:
+    hparams = parsed_hparams[hp_prop]
     hparam_names.update(hparams.keys())
-    hparams[RUN_ID_KEY] = run_id
-    trainer_id = ex.properties[_COMPONENT_ID].string_value.replace(
-        _TRAINER_PREFIX, '')
-    result_key = run_id + trainer_id
-    hparams[BENCHMARK_KEY] = trainer_id[1:]  # Removing '.' prefix
-    # BeamDagRunner uses iso format timestamp. See for details:
-    # http://google3/third_party/py/tfx/orchestration/beam/beam_dag_runner.py
-    try:
-      hparams[STARTED_AT] = datetime.datetime.fromtimestamp(int(run_id))
-    except ValueError:
-      hparams[STARTED_AT] = run_id
-    results[result_key] = hparams
-  return _Result(properties=results, property_names=sorted(hparam_names))
+    row = {
+        **hparams,
+        RUN_ID_KEY: run_id,
+        BENCHMARK_KEY: benchmark,
+        STARTED_AT: _parse_started_at(run_id),
+    }
+    # Rows with the same hparams string must not share list or dict values.
+    for name, val in hparams.items():
+      if isinstance(val, (list, dict)):
+        row[name] = copy.deepcopy(val)
+    results[(run_id, benchmark)] = row
+  return _Result(properties=results, property_names=hparam_names)
 
 
 def _get_artifact_run_info_map(store: metadata_store.MetadataStore,
@@ -176,21 +335,24 @@ def _get_artifact_run_info_map(store: metadata_store.MetadataStore,
   Returns:
     A dictionary containing artifact_id as a key and MyOrchestrator run_id as value.
   """
+  if not artifact_ids:
+    return {}
+
   # Get events of artifacts.
-  events = store.get_events_by_artifact_ids(artifact_ids)
-  exec_to_artifact = {}
-  for event in events:
-    exec_to_artifact[event.execution_id] = event.artifact_id
+  exec_to_artifacts = collections.defaultdict(list)
+  for ids in _iter_chunks(artifact_ids):
+    for event in store.get_events_by_artifact_ids(ids):
+      exec_to_artifacts[event.execution_id].append(event.artifact_id)
 
   # Get execution of artifacts.
-  executions = store.get_executions_by_id(list(exec_to_artifact.keys()))
   artifact_to_run_info = {}
-  for execution in executions:
-    run_id = execution.properties[RUN_ID_KEY].string_value
-    component = execution.properties[_COMPONENT_ID].string_value
-    artifact_id = exec_to_artifact[execution.id]
-    artifact_to_run_info[artifact_id] = _RunInfo(
-        run_id=run_id, component_name=component)
+  for ids in _iter_chunks(list(exec_to_artifacts.keys())):
+    for execution in store.get_executions_by_id(ids):
+      run_info = _RunInfo(
+          run_id=execution.properties[RUN_ID_KEY].string_value,
+          component_name=execution.properties[_COMPONENT_ID].string_value)
+      for artifact_id in exec_to_artifacts[execution.id]:
+        artifact_to_run_info[artifact_id] = run_info
 
   return artifact_to_run_info
 
@@ -206,12 +368,14 @@ def _get_benchmark_results(store: metadata_store.MetadataStore) -> _Result:
   """
   metrics = {}
   property_names = set()
-  publisher_artifacts = store.get_artifacts_by_type(_BENCHMARK_RESULT)
+  publisher_artifacts = _iter_by_type(
+      store.get_artifacts, store.get_artifacts_by_type, _BENCHMARK_RESULT)
   for artifact in publisher_artifacts:
-    evals = {}
-    for key, val in artifact.custom_properties.items():
-      evals[key] = _parse_value(val)
-    property_names = property_names.union(evals.keys())
+    evals = {
+        key: _parse_value(val)
+        for key, val in artifact.custom_properties.items()
+    }
+    property_names.update(evals.keys())
     metrics[artifact.id] = evals
 
   artifact_to_run_info = _get_artifact_run_info_map(store, list(metrics.keys()))
@@ -220,18 +384,11 @@ def _get_benchmark_results(store: metadata_store.MetadataStore) -> _Result:
   for artifact_id, evals in metrics.items():
     run_info = artifact_to_run_info[artifact_id]
     evals[RUN_ID_KEY] = run_info.run_id
-    # BeamDagRunner uses iso format timestamp. See for details:
-    # http://google3/third_party/py/tfx/orchestration/beam/beam_dag_runner.py
-    try:
-      evals[STARTED_AT] = datetime.datetime.fromtimestamp(int(run_info.run_id))
-    except ValueError:
-      evals[STARTED_AT] = run_info.run_id
-    result_key = run_info.run_id + '.' + evals[BENCHMARK_KEY]
-    properties[result_key] = evals
+    evals[STARTED_AT] = _parse_started_at(run_info.run_id)
+    properties[(run_info.run_id, evals[BENCHMARK_KEY])] = evals
 
-  property_names = property_names.difference(
-      {_NAME, _PRODUCER_COMPONENT, _STATE, *_DEFAULT_COLUMNS})
-  return _Result(properties=properties, property_names=sorted(property_names))
+  property_names -= _EXCLUDED_METRIC_COLUMNS
+  return _Result(properties=properties, property_names=property_names)
 
 
 def _get_kaggle_results(store: metadata_store.MetadataStore) -> _Result:
@@ -245,28 +402,29 @@ def _get_kaggle_results(store: metadata_store.MetadataStore) -> _Result:
   """
   results = {}
   property_names = set()
-  kaggle_artifacts = store.get_artifacts_by_type(_KAGGLE_RESULT)
+  kaggle_artifacts = _iter_by_type(
+      store.get_artifacts, store.get_artifacts_by_type, _KAGGLE_RESULT)
   for artifact in kaggle_artifacts:
     submit_info = {}
     for key, val in artifact.custom_properties.items():
       if key not in _DEFAULT_CUSTOM_PROPERTIES:
         name = _KAGGLE + '_' + key
         submit_info[name] = _parse_value(val)
-    property_names = property_names.union(submit_info.keys())
+    property_names.update(submit_info.keys())
     results[artifact.id] = submit_info
 
   artifact_to_run_info = _get_artifact_run_info_map(store, list(results.keys()))
 
+  # Publisher component ids are the publisher prefix, a '.' and the benchmark.
+  prefix_len = len(_KAGGLE_PUBLISHER_PREFIX) + 1
   properties = {}
   for artifact_id, submit_info in results.items():
     run_info = artifact_to_run_info[artifact_id]
-    result_key = run_info.run_id + run_info.component_name.replace(
-        _KAGGLE_PUBLISHER_PREFIX, '')
-    properties[result_key] = submit_info
+    benchmark = run_info.component_name[prefix_len:]
+    properties[(run_info.run_id, benchmark)] = submit_info
 
-  property_names = property_names.difference(
-      {_NAME, _PRODUCER_COMPONENT, _STATE, *_DEFAULT_COLUMNS})
-  return _Result(properties=properties, property_names=sorted(property_names))
+  property_names -= _EXCLUDED_METRIC_COLUMNS
+  return _Result(properties=properties, property_names=property_names)
 
 
 def get_model_dir_map(store: metadata_store.MetadataStore) -> Dict[str, str]:
@@ -309,26 +467,71 @@ def get_statisticsgen_dir_list(
   return stat_dirs_list
 
 
+def _arrow_scalar_type(values: pd.Series) -> Optional[Any]:
+  """Returns the Arrow type of values if they are scalars of one type."""
+  return {
+      'string': pa.string(),
+      'integer': pa.int64(),
+      'floating': pa.float64(),
+      'boolean': pa.bool_(),
+  }.get(pd.api.types.infer_dtype(values, skipna=True))
+
+
+def _columns_to_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+  """Backs the scalar columns of df by pyarrow arrays on pandas>=2.
+
+  Arrow-backed columns are more compact than object arrays of strings and are
+  faster to transform and group by. On older pandas, Arrow columns convert back
+  to the numpy columns that df already has, so df is returned as is. The Arrow
+  type of each column is inferred before converting it, and columns fall back
+  one by one. Columns without a single scalar type, e.g. list or dict hparams
+  or hparams mixing ints and strings, and ints too large for int64 keep their
+  values as is.
+
+  Args:
+    df: A pandas DataFrame.
+
+  Returns:
+    A pandas DataFrame with the same columns as df, in order.
+  """
+  if pa is None or _PANDAS_MAJOR_VERSION < 2:
+    return df
+  arrays = {}
+  for column, values in df.items():
+    arrow_type = _arrow_scalar_type(values)
+    if arrow_type is None:
+      continue
+    try:
+      arrays[column] = pa.array(values, type=arrow_type, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+      continue
+  if not arrays:
+    return df
+  converted = pa.table(arrays).to_pandas(types_mapper=pd.ArrowDtype)
+  converted.index = df.index
+  return df.assign(**{column: converted[column] for column in converted})
+
+
 def _make_dataframe(metrics_list: List[Dict[str, Any]],
                     columns: List[str]) -> pd.DataFrame:
   """Makes pandas.DataFrame from metrics_list."""
   df = pd.DataFrame(metrics_list)
-  if not df.empty:
-    # Reorder columns.
-    # Strip benchmark run repetition for aggregation.
-    df[BENCHMARK_FULL_KEY] = df[BENCHMARK_KEY]
-    df[BENCHMARK_KEY] = df[BENCHMARK_KEY].apply(
-        lambda x: re.sub(r'\.run_\d_of_\d$', '', x))
-
-    key_columns = list(_DATAFRAME_CONTEXTUAL_COLUMNS)
-    if RUN_KEY not in df:
-      key_columns.remove(RUN_KEY)
-    if NUM_RUNS_KEY not in df:
-      key_columns.remove(NUM_RUNS_KEY)
-    df = df[key_columns + columns]
-
-    df = df.set_index([STARTED_AT])
+  if df.empty:
+    return df
 
+  df[BENCHMARK_FULL_KEY] = df[BENCHMARK_KEY]
+  key_columns = [
+      column for column in _DATAFRAME_CONTEXTUAL_COLUMNS
+      if column not in (RUN_KEY, NUM_RUNS_KEY) or column in df
+  ]
+  df = _columns_to_dataframe(df[key_columns + columns])
+  if NUM_RUNS_KEY in df:
+    df[NUM_RUNS_KEY] = pd.to_numeric(df[NUM_RUNS_KEY], downcast='integer')
+
+  # Strip benchmark run repetition for aggregation. The pattern is a string
+  # because Arrow-backed strings do not accept compiled patterns.
+  df[BENCHMARK_KEY] = df[BENCHMARK_KEY].str.replace(
+      _RUN_SUFFIX_PATTERN, '', regex=True)
   return df
 
 
@@ -337,22 +540,22 @@ def _aggregate_results(df: pd.DataFrame,
                        groupby_columns: List[str]):
   """Aggregates metrics in an overview pd.DataFrame."""
 
-  df = df.copy()
-  groupby_columns = groupby_columns.copy()
   if RUN_KEY in df:
     df = df.drop([RUN_KEY], axis=1)
-  groupby_columns.remove(RUN_KEY)
-  groupby_columns.remove(BENCHMARK_FULL_KEY)
-  if NUM_RUNS_KEY not in df:
-    groupby_columns.remove(NUM_RUNS_KEY)
+  groupby_columns = [
+      column for column in groupby_columns
+      if column not in (RUN_KEY, BENCHMARK_FULL_KEY) and
+      (column != NUM_RUNS_KEY or NUM_RUNS_KEY in df)
+  ]
 
   # Group by contextual columns and aggregate metrics.
-  df = df.groupby(groupby_columns)
+  df = df.groupby(groupby_columns, sort=False)
   df = df.agg(metric_aggregators)
 
   # Flatten MultiIndex into a DataFrame.
   df.columns = [' '.join(col).strip() for col in df.columns.values]
-  return df.reset_index().set_index('started_at')
+  df = df.reset_index()
+  return df.set_index('started_at')
 
 
 def overview(
@@ -387,20 +590,25 @@ def overview(
   metrics_result = _get_benchmark_results(store)
   kaggle__result = _get_kaggle_results(store)
 
-  # Merge results
-  result = _merge_results([hparams_result, metrics_result, kaggle__result])
-
-  # Filter metrics that have empty hparams and evaluation results.
-  results_list = [
-      result for result in result.properties.values()
-      if len(result) > len(_DEFAULT_COLUMNS)
+  # Merge results into the rows of the benchmark results, which drops hparams
+  # and kaggle results without evaluation results.
+  result = _merge_results([hparams_result, metrics_result, kaggle__result],
+                          keys=metrics_result.properties)
+  results_list = list(result.properties.values())
+
+  # Sort each result's columns separately so they stay grouped by source.
+  hparam_names = sorted(hparams_result.property_names & result.property_names)
+  columns = [
+      *hparam_names,
+      *sorted(metrics_result.property_names),
+      *sorted(kaggle__result.property_names & result.property_names)
   ]
-
-  df = _make_dataframe(results_list, result.property_names)
+  df = _make_dataframe(results_list, columns)
+  if df.empty:
+    return df
   if metric_aggregators:
     return _aggregate_results(
         df,
         metric_aggregators=metric_aggregators,
-        groupby_columns=list(_DATAFRAME_CONTEXTUAL_COLUMNS) +
-        hparams_result.property_names)
-  return df
+        groupby_columns=list(_DATAFRAME_CONTEXTUAL_COLUMNS) + hparam_names)
+  return df.set_index(STARTED_AT)
@@ -17,9 +17,12 @@
 
 import datetime
 import os
+from unittest import mock
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import numpy as np
+import pandas as pd
 
 from nitroml import results
 from nitroml.testing import test_mlmd
@@ -263,6 +266,72 @@ class ToPyTypeTest(absltest.TestCase):
     val = results._to_pytype('Awesome')
     self.assertEqual(val, 'Awesome')
 
+  def testListVal(self):
+    val = results._to_pytype('[1, 2]')
+    self.assertEqual(val, [1, 2])
+
+  def testNegativeAndExponentVal(self):
+    self.assertEqual(results._to_pytype('-3'), -3)
+    self.assertEqual(results._to_pytype('1e-3'), 0.001)
+
+  def testNonJsonNumberVal(self):
+    # int() and float() accept these, but they are not JSON numbers.
+    for val in ('2020_05_21', '1_000', '007', '+5', 'nan', 'Infinity', '١٢'):
+      self.assertEqual(results._to_pytype(val), val)
+
+
+class ParseScalarTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ('int', '94', 94),
+      ('float', '0.9312', 0.9312),
+      ('bool', 'True', True),
+      ('none', 'None', None),
+      ('null', 'null', None),
+      ('string', '[1, 2]', '[1, 2]'),
+  )
+  def testParseScalar(self, val, want):
+    self.assertEqual(want, results._parse_scalar(val))
+
+
+class ParseValueTest(absltest.TestCase):
+
+  def testIntVal(self):
+    value = metadata_store_pb2.Value(int_value=5)
+    self.assertEqual(results._parse_value(value), 5)
+
+  def testDoubleVal(self):
+    value = metadata_store_pb2.Value(double_value=0.25)
+    self.assertEqual(results._parse_value(value), 0.25)
+
+  def testStringVal(self):
+    value = metadata_store_pb2.Value(string_value='0.25')
+    self.assertEqual(results._parse_value(value), 0.25)
+
+  def testNonJsonNumberStringVal(self):
+    for string_value in ('2020_05_21', '007', '+5'):
+      value = metadata_store_pb2.Value(string_value=string_value)
+      self.assertEqual(results._parse_value(value), string_value)
+
+  def testBoolVal(self):
+    value = metadata_store_pb2.Value(bool_value=True)
+    self.assertIs(results._parse_value(value), True)
+
+  def testUnsetVal(self):
+    value = metadata_store_pb2.Value()
+    self.assertEqual(results._parse_value(value), '')
+
+
+class ParseStartedAtTest(absltest.TestCase):
+
+  def testTimestampRunId(self):
+    started_at = results._parse_started_at('0')
+    self.assertEqual(started_at, datetime.datetime.fromtimestamp(0))
+
+  def testIsoFormatRunId(self):
+    started_at = results._parse_started_at('2020-05-21T16:58:41.314044')
+    self.assertEqual(started_at, '2020-05-21T16:58:41.314044')
+
 
 class ParseHparamsTest(parameterized.TestCase):
 
@@ -302,76 +371,117 @@ class ParseHparamsTest(parameterized.TestCase):
               'learning_rate': 0.05,
               'is_awesome': 'yes'
           }
+      }, {
+          'testcase_name': 'double_quoted_val',
+          'hp_prop': """["name=it's", 'batch_size=256']""",
+          'want': {
+              'name': "it's",
+              'batch_size': 256
+          }
       })
   def testParseHparams(self, hp_prop, want):
     hparams = results._parse_hparams(hp_prop)
     self.assertEqual(hparams, want)
 
 
+class ParseHparamsStringsTest(absltest.TestCase):
+
+  def testParseHparamsStrings(self):
+    hp_props = ["['batch_size=%d']" % i for i in (1, 2, 1)]
+
+    with mock.patch.object(
+        results, '_parse_hparams', wraps=results._parse_hparams) as parse:
+      parsed = results._parse_hparams_strings(hp_props)
+
+    self.assertEqual(
+        {
+            "['batch_size=1']": {
+                'batch_size': 1
+            },
+            "['batch_size=2']": {
+                'batch_size': 2
+            }
+        }, parsed)
+    self.assertEqual(2, parse.call_count)
+
+
 class MergeResultTest(absltest.TestCase):
 
   def testEmptyMergeResults(self):
-    result1 = results._Result(properties={}, property_names=[])
-    result2 = results._Result(properties={}, property_names=[])
+    result1 = results._Result(properties={}, property_names=set())
+    result2 = results._Result(properties={}, property_names=set())
 
-    merge_result = results._merge_results([result1, result2])
+    merge_result = results._merge_results([result1, result2], keys=[])
 
     self.assertEqual(
-        results._Result(properties={}, property_names=[]), merge_result)
+        results._Result(properties={}, property_names=set()), merge_result)
 
   def testOneEmptyMergeResults(self):
     result1 = results._Result(
         properties={'key': {
             'nkey': 'val'
-        }}, property_names=['test'])
-    result2 = results._Result(properties={}, property_names=[])
+        }}, property_names={'nkey'})
+    result2 = results._Result(properties={}, property_names=set())
 
-    merge_result = results._merge_results([result1, result2])
+    merge_result = results._merge_results([result1, result2],
+                                          keys=result1.properties)
 
     self.assertEqual(
         results._Result(
             properties={'key': {
                 'nkey': 'val'
-            }}, property_names=['test']), merge_result)
+            }}, property_names={'nkey'}), merge_result)
+
+  def testDropsRowsWithOtherKeys(self):
+    result1 = results._Result(properties={}, property_names=set())
+    result2 = results._Result(
+        properties={'key': {
+            'nkey': 'val'
+        }}, property_names={'nkey'})
+
+    merge_result = results._merge_results([result1, result2],
+                                          keys=result1.properties)
+
+    self.assertEqual(
+        results._Result(properties={}, property_names=set()), merge_result)
 
   def testMergeResults(self):
     result1 = results._Result(
         properties={
             'key1': {
-                'hparam': 'val'
+                'hparam': 'val',
+                'accuracy': 'hparam'
             },
-            'key2': {
-                'hparam': 'val'
+            'key3': {
+                'orphan_hparam': 'val'
             }
         },
-        property_names=['hparam_names'])
+        property_names={'hparam', 'accuracy', 'orphan_hparam'})
     result2 = results._Result(
         {
             'key1': {
-                'metrics': 'val'
+                'accuracy': 0.5
             },
-            'key3': {
-                'metrics': 'val'
+            'key2': {
+                'accuracy': 0.75
             }
         },
-        property_names=['metric_names'])
+        property_names={'accuracy'})
 
-    merge_result = results._merge_results([result1, result2])
+    merge_result = results._merge_results([result1, result2],
+                                          keys=result2.properties)
 
     want_result = results._Result(
         properties={
             'key1': {
                 'hparam': 'val',
-                'metrics': 'val'
+                'accuracy': 0.5
             },
             'key2': {
-                'hparam': 'val'
-            },
-            'key3': {
-                'metrics': 'val'
+                'accuracy': 0.75
             }
         },
-        property_names=['hparam_names', 'metric_names'])
+        property_names={'hparam', 'accuracy'})
     self.assertEqual(want_result, merge_result)
 
 
@@ -402,6 +512,18 @@ class GetHparamsTest(absltest.TestCase):
     execution.type_id = self.test_mlmd.exec_type_id
     self.test_mlmd.store.put_executions([execution])
 
+  def testRowsDoNotShareValues(self):
+    hparam = "['hidden_units=[64, 32]']"
+    for benchmark in ('Test1', 'Test2'):
+      self._put_execution('0', results._TRAINER_PREFIX + '.' + benchmark,
+                          hparam)
+
+    result = results._get_hparams(self.test_mlmd.store)
+    result.properties[('0', 'Test1')]['hidden_units'].append(16)
+
+    self.assertEqual([64, 32],
+                     result.properties[('0', 'Test2')]['hidden_units'])
+
   def testGetHparams(self):
     hparam = "['batch_size=256', 'learning_rate=0.05', 'decay_rate=0.95']"
     run_id = '0'
@@ -412,7 +534,7 @@ class GetHparamsTest(absltest.TestCase):
 
     want_result = results._Result(
         properties={
-            '0.Test': {
+            ('0', 'Test'): {
                 'batch_size': 256,
                 'learning_rate': 0.05,
                 'decay_rate': 0.95,
@@ -421,10 +543,72 @@ class GetHparamsTest(absltest.TestCase):
                 results.STARTED_AT: datetime.datetime.fromtimestamp(0)
             }
         },
-        property_names=['batch_size', 'decay_rate', 'learning_rate'])
+        property_names={'batch_size', 'decay_rate', 'learning_rate'})
     self.assertEqual(want_result, result)
 
 
+class IterByTypeTest(absltest.TestCase):
+
+  def __init__(self, *args, **kwargs):
+    super(IterByTypeTest, self).__init__(*args, **kwargs)
+    self.test_mlmd = test_mlmd.TestMLMD()
+
+  def testPaginates(self):
+    artifact_ids = [
+        self.test_mlmd.put_artifact({'accuracy': str(i)}) for i in range(5)
+    ]
+
+    artifacts = results._iter_by_type(
+        self.test_mlmd.store.get_artifacts,
+        self.test_mlmd.store.get_artifacts_by_type,
+        self.test_mlmd.artifact_type,
+        page_size=2)
+
+    self.assertEqual(artifact_ids, [artifact.id for artifact in artifacts])
+
+  def testWithoutFilterQuery(self):
+    artifact_ids = [
+        self.test_mlmd.put_artifact({'accuracy': str(i)}) for i in range(5)
+    ]
+
+    with mock.patch.object(results, '_SUPPORTS_FILTER_QUERY', False):
+      artifacts = list(
+          results._iter_by_type(
+              mock.Mock(side_effect=AssertionError('list_options used')),
+              self.test_mlmd.store.get_artifacts_by_type,
+              self.test_mlmd.artifact_type,
+              page_size=2))
+
+    self.assertEqual(artifact_ids, [artifact.id for artifact in artifacts])
+
+
+class GetArtifactRunInfoMapTest(absltest.TestCase):
+
+  def __init__(self, *args, **kwargs):
+    super(GetArtifactRunInfoMapTest, self).__init__(*args, **kwargs)
+    self.test_mlmd = test_mlmd.TestMLMD()
+
+  def testNoArtifacts(self):
+    run_info_map = results._get_artifact_run_info_map(self.test_mlmd.store, [])
+    self.assertEqual({}, run_info_map)
+
+  def testMultipleArtifactsPerExecution(self):
+    execution_id = self.test_mlmd.put_execution('0')
+    artifact_ids = [
+        self.test_mlmd.put_artifact({results.BENCHMARK_KEY: name})
+        for name in ('Test1', 'Test2')
+    ]
+    for artifact_id in artifact_ids:
+      self.test_mlmd.put_event(artifact_id, execution_id)
+
+    run_info_map = results._get_artifact_run_info_map(self.test_mlmd.store,
+                                                      artifact_ids)
+
+    self.assertEqual(
+        {artifact_id: '0' for artifact_id in artifact_ids},
+        {key: run_info.run_id for key, run_info in run_info_map.items()})
+
+
 class GetBenchmarkResultsTest(absltest.TestCase):
 
   def __init__(self, *args, **kwargs):
@@ -445,7 +629,7 @@ class GetBenchmarkResultsTest(absltest.TestCase):
 
     want_result = results._Result(
         properties={
-            '0.Test': {
+            ('0', 'Test'): {
                 'accuracy': 0.25,
                 'average_loss': 2.40,
                 results.RUN_ID_KEY: '0',
@@ -453,10 +637,121 @@ class GetBenchmarkResultsTest(absltest.TestCase):
                 results.STARTED_AT: datetime.datetime.fromtimestamp(0)
             }
         },
-        property_names=['accuracy', 'average_loss'])
+        property_names={'accuracy', 'average_loss'})
     self.assertEqual(want_result, result)
 
 
+class ColumnsToDataframeTest(absltest.TestCase):
+
+  def testMixedTypes(self):
+    data = {'accuracy': [0.5, None], 'optimizer': [1, 'adam']}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual(['accuracy', 'optimizer'], df.columns.tolist())
+    self.assertEqual([1, 'adam'], df['optimizer'].tolist())
+
+  def testListVal(self):
+    data = {'hidden_units': [[64, 32], [16]]}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual([[64, 32], [16]], df['hidden_units'].tolist())
+    self.assertIsInstance(df['hidden_units'][0], list)
+
+  def testDictVal(self):
+    data = {'config': [{'a': 1}, {'b': 2}]}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual([{'a': 1}, {'b': 2}], df['config'].tolist())
+
+  def testBigIntVal(self):
+    data = {'seed': [2**70, 1]}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual([2**70, 1], df['seed'].tolist())
+
+  def testFallsBackPerColumn(self):
+    data = {'hidden_units': [[64, 32], [16]], 'optimizer': ['adam', 'sgd']}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual(['hidden_units', 'optimizer'], df.columns.tolist())
+    self.assertEqual([[64, 32], [16]], df['hidden_units'].tolist())
+    self.assertEqual(['adam', 'sgd'], df['optimizer'].tolist())
+
+  def testMissingStringVal(self):
+    data = {'status': ['complete', np.nan]}
+
+    df = results._columns_to_dataframe(pd.DataFrame(data))
+
+    self.assertEqual('complete', df['status'][0])
+    self.assertIsNotNone(df['status'][1])
+    self.assertTrue(pd.isna(df['status'][1]))
+
+
+class MakeDataframeTest(absltest.TestCase):
+
+  def testStripsRunSuffix(self):
+    metrics_list = [{
+        results.STARTED_AT: '0',
+        results.RUN_ID_KEY: '0',
+        results.BENCHMARK_KEY: 'Test.run_%d_of_12' % run,
+        'accuracy': 0.5,
+    } for run in (2, 10)]
+
+    df = results._make_dataframe(metrics_list, ['accuracy'])
+
+    self.assertEqual(['Test', 'Test'], df[results.BENCHMARK_KEY].tolist())
+    self.assertEqual(['Test.run_2_of_12', 'Test.run_10_of_12'],
+                     df[results.BENCHMARK_FULL_KEY].tolist())
+
+  def testMissingValuesAreNaN(self):
+    metrics_list = [{
+        results.STARTED_AT: '0',
+        results.RUN_ID_KEY: '0',
+        results.BENCHMARK_KEY: 'Test',
+        'kaggle_status': 'complete',
+    }, {
+        results.STARTED_AT: '0',
+        results.RUN_ID_KEY: '0',
+        results.BENCHMARK_KEY: 'Test2',
+    }]
+
+    df = results._make_dataframe(metrics_list, ['kaggle_status'])
+
+    self.assertEqual('complete', df['kaggle_status'][0])
+    self.assertIsNotNone(df['kaggle_status'][1])
+    self.assertTrue(pd.isna(df['kaggle_status'][1]))
+
+
+class AggregateResultsTest(absltest.TestCase):
+
+  def testKeepsKeyDtypes(self):
+    metrics_list = [{
+        results.STARTED_AT: datetime.datetime.fromtimestamp(0),
+        results.RUN_ID_KEY: '0',
+        results.BENCHMARK_KEY: 'Test.run_%d_of_2' % run,
+        results.RUN_KEY: run,
+        results.NUM_RUNS_KEY: 2,
+        'accuracy': accuracy,
+    } for run, accuracy in ((1, 0.25), (2, 0.75))]
+    # pandas>=2 no longer drops string columns that cannot be averaged.
+    df = results._make_dataframe(metrics_list, ['accuracy']).drop(
+        columns=[results.BENCHMARK_FULL_KEY])
+
+    aggregated = results._aggregate_results(
+        df,
+        metric_aggregators=['mean'],
+        groupby_columns=list(results._DATAFRAME_CONTEXTUAL_COLUMNS))
+
+    self.assertEqual([0.5], aggregated['accuracy mean'].tolist())
+    for column in (results.RUN_ID_KEY, results.BENCHMARK_KEY):
+      self.assertEqual(df[column].dtype, aggregated[column].dtype)
+
+
 class GetStatisticsGenDirectoryTest(absltest.TestCase):
 
   def __init__(self, *args, **kwargs):